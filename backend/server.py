@@ -1,18 +1,25 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Query
+from fastapi.responses import ORJSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
 from typing import List, Optional
 import uuid
 from datetime import datetime, timezone
 import aiohttp
 import asyncio
-from bs4 import BeautifulSoup
+from selectolax.lexbor import LexborHTMLParser
 import re
+import hashlib
+import weakref
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from cachetools import TTLCache
+import tiktoken
 from emergentintegrations.llm.chat import LlmChat, UserMessage
 
 ROOT_DIR = Path(__file__).parent
@@ -20,11 +27,17 @@ load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(
+    mongo_url,
+    maxPoolSize=50,
+    minPoolSize=5,
+    serverSelectionTimeoutMS=3000,
+    socketTimeoutMS=10000
+)
 db = client[os.environ['DB_NAME']]
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -34,6 +47,82 @@ llm_key = os.environ.get('EMERGENT_LLM_KEY')
 if not llm_key:
     raise ValueError("EMERGENT_LLM_KEY not found in environment variables")
 
+# Shared HTTP session for URL extraction (created on startup)
+_http_session: Optional[aiohttp.ClientSession] = None
+
+# Limits on fetched pages
+MAX_CONTENT_LENGTH = 5_000_000  # reject larger declared bodies outright
+MAX_HTML_BYTES = 2_000_000  # stop reading the body past this size
+READ_CHUNK_SIZE = 65536
+HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
+
+# Main content selectors, in order of preference
+CONTENT_SELECTORS = (
+    'article', '.article-content', '.post-content',
+    '.entry-content', 'main', '.main-content',
+    '.story-body', '.article-body'
+)
+WHITESPACE_RE = re.compile(r'\s+')
+JSON_OBJECT_RE = re.compile(r'\{.*\}', re.DOTALL)
+
+# Extracted (content, title) by normalized URL, with per-URL fetch locks
+_url_cache: TTLCache = TTLCache(maxsize=1024, ttl=600)
+_url_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+# System prompt for news analysis
+SYSTEM_MESSAGE = """You are an expert fact-checker and media analyst with extensive experience in identifying fake news, misinformation, bias, and assessing source credibility. Your task is to provide comprehensive analysis of news content.
+
+For each analysis, evaluate:
+1. FAKE NEWS DETECTION: Determine if content is real, fake, misleading, satirical, or opinion-based
+2. BIAS ANALYSIS: Identify political, commercial, emotional, or other biases
+3. SOURCE CREDIBILITY: Assess the reliability and reputation of the source (if URL provided)
+4. EVIDENCE & REASONING: Provide specific examples and explanations
+
+Return your analysis in the following JSON format:
+{
+  "fake_news_analysis": {
+    "is_fake": boolean,
+    "confidence_score": float (0-100),
+    "classification": string ("Real News", "Fake News", "Misleading", "Satirical", "Opinion"),
+    "reasoning": [list of specific reasons],
+    "evidence": [list of evidence supporting the classification],
+    "red_flags": [list of warning signs or suspicious elements]
+  },
+  "bias_analysis": {
+    "bias_score": float (0-10, where 0 is neutral),
+    "bias_type": string (primary type of bias detected),
+    "bias_indicators": [list of specific bias indicators],
+    "explanation": string (detailed explanation of bias detected)
+  },
+  "source_credibility": {
+    "credibility_score": float (0-10),
+    "credibility_factors": [list of positive credibility factors],
+    "reputation_indicators": [list of reputation indicators],
+    "concerns": [list of credibility concerns]
+  },
+  "overall_assessment": string (summary of overall findings),
+  "recommendations": [list of recommendations for readers]
+}
+
+Be thorough but concise. Provide specific examples from the content to support your analysis."""
+
+# Static parts of the analysis prompt around the content
+PROMPT_PREFIX = "Please analyze the following content for fake news, bias, and credibility:\n\nCONTENT TO ANALYZE:\n"
+PROMPT_SUFFIX_TEMPLATE = "\n\nSOURCE URL: {url}\n\nProvide your analysis in the specified JSON format."
+
+# Token budget for analyzed content, leaving room for the system message and JSON output
+MAX_CONTENT_TOKENS = 6000
+# Loaded on startup: tiktoken downloads the encoding file unless TIKTOKEN_CACHE_DIR holds a copy
+_encoding: Optional[tiktoken.Encoding] = None
+
+# In-flight LLM analyses keyed by content hash, shared by concurrent duplicates
+_inflight_analyses: dict[str, asyncio.Task] = {}
+
+# Buffered analysis history writer (created on startup)
+HISTORY_BATCH_SIZE = 50
+_history_queue: Optional[asyncio.Queue] = None
+_history_writer_task: Optional[asyncio.Task] = None
+
 # Define Models
 class NewsAnalysisRequest(BaseModel):
     content: Optional[str] = None
@@ -60,6 +149,14 @@ class FakeNewsAnalysis(BaseModel):
     evidence: List[str]
     red_flags: List[str]
 
+class AnalysisPayload(BaseModel):
+    """Analysis JSON returned by the LLM"""
+    fake_news_analysis: FakeNewsAnalysis
+    bias_analysis: BiasAnalysis
+    source_credibility: Optional[SourceCredibility] = None
+    overall_assessment: str
+    recommendations: List[str]
+
 class NewsAnalysisResponse(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     content: str
@@ -76,143 +173,217 @@ class AnalysisHistory(BaseModel):
     analysis: NewsAnalysisResponse
     timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class FakeNewsSummary(BaseModel):
+    classification: str
+    confidence_score: float
+
+class AnalysisSummary(BaseModel):
+    id: str
+    content: str
+    source_url: Optional[str]
+    fake_news_analysis: FakeNewsSummary
+    overall_assessment: str
+    timestamp: datetime
+
+class AnalysisHistorySummary(BaseModel):
+    id: str
+    analysis: AnalysisSummary
+    timestamp: datetime
+
+# Fields needed to render the history list
+HISTORY_SUMMARY_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "timestamp": 1,
+    "analysis.id": 1,
+    "analysis.content": 1,
+    "analysis.source_url": 1,
+    "analysis.overall_assessment": 1,
+    "analysis.fake_news_analysis.classification": 1,
+    "analysis.fake_news_analysis.confidence_score": 1,
+    "analysis.timestamp": 1
+}
+
+def normalize_url(url: str) -> str:
+    """Normalize URL for cache lookups: lowercase scheme and host, sort query, drop fragment"""
+    parts = urlsplit(url.strip())
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or '/', query, ''))
+
 async def extract_content_from_url(url: str) -> tuple[str, str]:
-    """Extract content from URL and return (content, title)"""
+    """Extract content from URL and return (content, title), serving repeat URLs from cache"""
+    key = normalize_url(url)
+    cached = _url_cache.get(key)
+    if cached is not None:
+        return cached
+    
+    # Only one request per URL fetches; concurrent requests wait and reuse the result
+    lock = _url_locks.get(key)
+    if lock is None:
+        lock = asyncio.Lock()
+        _url_locks[key] = lock
+    
+    async with lock:
+        cached = _url_cache.get(key)
+        if cached is not None:
+            return cached
+        
+        content, title_text, cacheable = await fetch_content_from_url(url)
+        if cacheable:
+            _url_cache[key] = (content, title_text)
+        return content, title_text
+
+def parse_html(html: str) -> tuple[str, str]:
+    """Extract (content, title) from an HTML document"""
+    tree = LexborHTMLParser(html)
+    
+    # Remove script and style elements
+    for tag in tree.css('script, style'):
+        tag.decompose()
+    
+    # Extract title
+    title = tree.css_first('title')
+    title_text = title.text(strip=True) if title else "No title found"
+    
+    # Extract main content
+    content = ""
+    for selector in CONTENT_SELECTORS:
+        nodes = tree.css(selector)
+        if nodes:
+            content = ' '.join(n.text() for n in nodes)
+            break
+    
+    if not content:
+        # Fallback to paragraphs
+        paragraphs = tree.css('p')
+        content = ' '.join(p.text() for p in paragraphs)
+    
+    # Clean up text
+    content = WHITESPACE_RE.sub(' ', content).strip()
+    
+    return content, title_text
+
+async def fetch_content_from_url(url: str) -> tuple[str, str, bool]:
+    """Fetch and extract content from URL and return (content, title, cacheable)"""
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, timeout=aiohttp.ClientTimeout(total=30)) as response:
-                if response.status != 200:
-                    raise HTTPException(status_code=400, detail=f"Failed to fetch URL: HTTP {response.status}")
-                
-                html = await response.text()
-                soup = BeautifulSoup(html, 'html.parser')
-                
-                # Remove script and style elements
-                for script in soup(["script", "style"]):
-                    script.decompose()
-                
-                # Extract title
-                title = soup.find('title')
-                title_text = title.get_text().strip() if title else "No title found"
-                
-                # Extract main content
-                content_selectors = [
-                    'article', '.article-content', '.post-content', 
-                    '.entry-content', 'main', '.main-content',
-                    '.story-body', '.article-body'
-                ]
-                
-                content = ""
-                for selector in content_selectors:
-                    elements = soup.select(selector)
-                    if elements:
-                        content = ' '.join([elem.get_text() for elem in elements])
-                        break
-                
-                if not content:
-                    # Fallback to paragraphs
-                    paragraphs = soup.find_all('p')
-                    content = ' '.join([p.get_text() for p in paragraphs])
-                
-                # Clean up text
-                content = re.sub(r'\s+', ' ', content).strip()
-                
-                if len(content) < 100:
-                    raise HTTPException(status_code=400, detail="Insufficient content extracted from URL")
-                
-                return content, title_text
-                
+        async with _http_session.get(url) as response:
+            if response.status != 200:
+                raise HTTPException(status_code=400, detail=f"Failed to fetch URL: HTTP {response.status}")
+            
+            cacheable = 'no-store' not in response.headers.get('Cache-Control', '').lower()
+            
+            if response.content_type not in HTML_CONTENT_TYPES:
+                raise HTTPException(status_code=415, detail=f"Unsupported content type: {response.content_type}")
+            
+            content_length = response.content_length
+            if content_length is not None and content_length > MAX_CONTENT_LENGTH:
+                raise HTTPException(status_code=413, detail=f"Page too large: {content_length} bytes")
+            
+            # Stream the body, keeping at most MAX_HTML_BYTES
+            buf = bytearray()
+            async for chunk in response.content.iter_chunked(READ_CHUNK_SIZE):
+                buf.extend(chunk)
+                if len(buf) >= MAX_HTML_BYTES:
+                    break
+            html = buf[:MAX_HTML_BYTES].decode(response.charset or 'utf-8', errors='replace')
+            content, title_text = await asyncio.to_thread(parse_html, html)
+            
+            if len(content) < 100:
+                raise HTTPException(status_code=400, detail="Insufficient content extracted from URL")
+            
+            return content, title_text, cacheable
+            
+    except HTTPException:
+        raise
     except aiohttp.ClientError as e:
         raise HTTPException(status_code=400, detail=f"Network error: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error extracting content: {str(e)}")
 
-async def analyze_with_llm(content: str, url: Optional[str] = None) -> NewsAnalysisResponse:
-    """Analyze content using OpenAI GPT-4o for comprehensive fake news detection"""
+def load_encoding():
+    """Load the GPT-4o tokenizer; blocking, so only called from the startup thread"""
+    global _encoding
+    try:
+        _encoding = tiktoken.encoding_for_model("gpt-4o")
+    except Exception as e:
+        raise RuntimeError(
+            f"Failed to load GPT-4o tokenizer: {str(e)}. "
+            "Set TIKTOKEN_CACHE_DIR to a directory with the prefetched encoding for offline use."
+        ) from e
+
+def truncate_to_tokens(content: str, max_tokens: int = MAX_CONTENT_TOKENS) -> str:
+    """Truncate content to at most max_tokens GPT-4o tokens"""
+    if _encoding is None:
+        # Tokenizer failed to load at startup; fall back to ~4 characters per token
+        return content[:max_tokens * 4]
     
-    system_message = """You are an expert fact-checker and media analyst with extensive experience in identifying fake news, misinformation, bias, and assessing source credibility. Your task is to provide comprehensive analysis of news content.
+    # Cut first so huge inputs are never tokenized in full
+    content = content[:max_tokens * 8]
+    tokens = _encoding.encode(content, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return content
+    return _encoding.decode(tokens[:max_tokens])
 
-For each analysis, evaluate:
-1. FAKE NEWS DETECTION: Determine if content is real, fake, misleading, satirical, or opinion-based
-2. BIAS ANALYSIS: Identify political, commercial, emotional, or other biases
-3. SOURCE CREDIBILITY: Assess the reliability and reputation of the source (if URL provided)
-4. EVIDENCE & REASONING: Provide specific examples and explanations
+async def analyze_with_llm(content: str, url: Optional[str] = None) -> NewsAnalysisResponse:
+    """Analyze content, sharing a single LLM call between concurrent duplicate requests"""
+    key = hashlib.blake2b(((url or '') + content).encode(), digest_size=16).hexdigest()
+    
+    task = _inflight_analyses.get(key)
+    if task is None:
+        # Run the shared call as its own task so no single caller's cancellation can cancel it
+        task = asyncio.create_task(run_llm_analysis(content, url))
+        _inflight_analyses[key] = task
+        task.add_done_callback(lambda t: finish_inflight_analysis(key, t))
+    return await asyncio.shield(task)
 
-Return your analysis in the following JSON format:
-{
-  "fake_news_analysis": {
-    "is_fake": boolean,
-    "confidence_score": float (0-100),
-    "classification": string ("Real News", "Fake News", "Misleading", "Satirical", "Opinion"),
-    "reasoning": [list of specific reasons],
-    "evidence": [list of evidence supporting the classification],
-    "red_flags": [list of warning signs or suspicious elements]
-  },
-  "bias_analysis": {
-    "bias_score": float (0-10, where 0 is neutral),
-    "bias_type": string (primary type of bias detected),
-    "bias_indicators": [list of specific bias indicators],
-    "explanation": string (detailed explanation of bias detected)
-  },
-  "source_credibility": {
-    "credibility_score": float (0-10),
-    "credibility_factors": [list of positive credibility factors],
-    "reputation_indicators": [list of reputation indicators],
-    "concerns": [list of credibility concerns]
-  },
-  "overall_assessment": string (summary of overall findings),
-  "recommendations": [list of recommendations for readers]
-}
+def finish_inflight_analysis(key: str, task: asyncio.Task):
+    """Drop a finished analysis from the in-flight map"""
+    _inflight_analyses.pop(key, None)
+    # Mark the exception as retrieved in case every caller has gone away
+    if not task.cancelled():
+        task.exception()
 
-Be thorough but concise. Provide specific examples from the content to support your analysis."""
+async def run_llm_analysis(content: str, url: Optional[str] = None) -> NewsAnalysisResponse:
+    """Analyze content using OpenAI GPT-4o for comprehensive fake news detection"""
 
     try:
-        # Initialize chat session
+        # LlmChat keeps per-session message history, so each analysis gets its own session
         chat = LlmChat(
             api_key=llm_key,
             session_id=str(uuid.uuid4()),
-            system_message=system_message
+            system_message=SYSTEM_MESSAGE
         ).with_model("openai", "gpt-4o")
         
         # Prepare analysis prompt
-        analysis_prompt = f"""Please analyze the following content for fake news, bias, and credibility:
-
-CONTENT TO ANALYZE:
-{content[:8000]}  # Limit content to avoid token limits
-
-SOURCE URL: {url if url else "Not provided"}
-
-Provide your analysis in the specified JSON format."""
+        analysis_prompt = (
+            PROMPT_PREFIX
+            + truncate_to_tokens(content)
+            + PROMPT_SUFFIX_TEMPLATE.format(url=url if url else "Not provided")
+        )
 
         user_message = UserMessage(text=analysis_prompt)
         response = await chat.send_message(user_message)
         
-        # Parse the LLM response
-        import json
+        # Parse and validate the LLM response in one pass
         try:
-            analysis_data = json.loads(response)
-        except json.JSONDecodeError:
-            # If JSON parsing fails, try to extract JSON from the response
-            import re
-            json_match = re.search(r'\{.*\}', response, re.DOTALL)
+            payload = AnalysisPayload.model_validate_json(response)
+        except ValidationError:
+            # If the response is not bare JSON, try to extract JSON from the response
+            json_match = JSON_OBJECT_RE.search(response)
             if json_match:
-                analysis_data = json.loads(json_match.group())
+                payload = AnalysisPayload.model_validate_json(json_match.group())
             else:
                 raise HTTPException(status_code=500, detail="Failed to parse analysis response")
         
         # Create response object
-        fake_news_analysis = FakeNewsAnalysis(**analysis_data["fake_news_analysis"])
-        bias_analysis = BiasAnalysis(**analysis_data["bias_analysis"])
-        source_credibility = SourceCredibility(**analysis_data["source_credibility"]) if "source_credibility" in analysis_data else None
-        
         analysis_response = NewsAnalysisResponse(
             content=content[:2000] + ("..." if len(content) > 2000 else ""),  # Truncate for storage
             source_url=url,
-            fake_news_analysis=fake_news_analysis,
-            bias_analysis=bias_analysis,
-            source_credibility=source_credibility,
-            overall_assessment=analysis_data["overall_assessment"],
-            recommendations=analysis_data["recommendations"]
+            fake_news_analysis=payload.fake_news_analysis,
+            bias_analysis=payload.bias_analysis,
+            source_credibility=payload.source_credibility,
+            overall_assessment=payload.overall_assessment,
+            recommendations=payload.recommendations
         )
         
         return analysis_response
@@ -221,6 +392,37 @@ Provide your analysis in the specified JSON format."""
         logging.error(f"LLM analysis error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
+async def flush_history_batch(batch: List[dict]):
+    """Insert a batch of history documents in a single round-trip"""
+    try:
+        await db.analysis_history.insert_many(batch, ordered=False)
+    except Exception as e:
+        logging.warning(f"Failed to store {len(batch)} analyses in database: {str(e)}")
+
+async def history_writer():
+    """Flush queued history documents in batches until a None sentinel arrives"""
+    while True:
+        item = await _history_queue.get()
+        if item is None:
+            return
+        
+        # Take whatever else is already queued, without waiting for more
+        batch = [item]
+        stop = False
+        while len(batch) < HISTORY_BATCH_SIZE:
+            try:
+                item = _history_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            if item is None:
+                stop = True
+                break
+            batch.append(item)
+        
+        await flush_history_batch(batch)
+        if stop:
+            return
+
 # API Endpoints
 @api_router.get("/")
 async def root():
@@ -241,6 +443,8 @@ async def analyze_news(request: NewsAnalysisRequest):
         try:
             extracted_content, title = await extract_content_from_url(request.url)
             content = f"{title}\n\n{extracted_content}"
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Failed to extract content from URL: {str(e)}")
     
@@ -250,38 +454,38 @@ async def analyze_news(request: NewsAnalysisRequest):
     # Perform analysis
     analysis = await analyze_with_llm(content, url)
     
-    # Store in database
+    # Queue for batched storage in database
     try:
         history_entry = AnalysisHistory(analysis=analysis)
-        analysis_dict = history_entry.dict()
-        # Convert datetime to ISO string for MongoDB
-        analysis_dict['timestamp'] = analysis_dict['timestamp'].isoformat()
-        analysis_dict['analysis']['timestamp'] = analysis_dict['analysis']['timestamp'].isoformat()
+        # JSON mode stores datetimes as ISO strings in MongoDB
+        analysis_dict = history_entry.model_dump(mode='json')
         
-        await db.analysis_history.insert_one(analysis_dict)
+        _history_queue.put_nowait(analysis_dict)
     except Exception as e:
         logging.warning(f"Failed to store analysis in database: {str(e)}")
     
     return analysis
 
-@api_router.get("/history", response_model=List[AnalysisHistory])
-async def get_analysis_history(limit: int = 20):
-    """Get recent analysis history"""
+@api_router.get("/history", response_model=List[AnalysisHistorySummary])
+async def get_analysis_history(limit: int = Query(20, ge=1, le=100)):
+    """Get recent analysis history summaries"""
     try:
-        history = await db.analysis_history.find().sort("timestamp", -1).limit(limit).to_list(length=limit)
-        
-        for item in history:
-            # Convert ISO strings back to datetime objects
-            if isinstance(item.get('timestamp'), str):
-                item['timestamp'] = datetime.fromisoformat(item['timestamp'])
-            if isinstance(item.get('analysis', {}).get('timestamp'), str):
-                item['analysis']['timestamp'] = datetime.fromisoformat(item['analysis']['timestamp'])
+        cursor = db.analysis_history.find({}, projection=HISTORY_SUMMARY_PROJECTION).sort("timestamp", -1).limit(limit)
         
-        return [AnalysisHistory(**item) for item in history]
+        # Validate each document as it streams in, so a malformed one hits the fallback below
+        return [AnalysisHistorySummary.model_validate(item) async for item in cursor]
     except Exception as e:
         logging.error(f"Failed to fetch history: {str(e)}")
         return []
 
+@api_router.get("/history/{analysis_id}", response_model=AnalysisHistory)
+async def get_analysis(analysis_id: str):
+    """Get a specific analysis from history"""
+    item = await db.analysis_history.find_one({"id": analysis_id}, projection={"_id": 0})
+    if item is None:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    return item
+
 @api_router.delete("/history/{analysis_id}")
 async def delete_analysis(analysis_id: str):
     """Delete a specific analysis from history"""
@@ -296,6 +500,8 @@ async def delete_analysis(analysis_id: str):
 # Include the router in the main app
 app.include_router(api_router)
 
+# Middleware added last is outermost; keep CORS as the outermost layer
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -311,6 +517,47 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def startup_http_session():
+    global _http_session
+    _http_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=100,
+            limit_per_host=10,
+            ttl_dns_cache=300,
+            keepalive_timeout=60,
+            enable_cleanup_closed=True
+        ),
+        timeout=aiohttp.ClientTimeout(total=30)
+    )
+
+@app.on_event("startup")
+async def startup_tokenizer():
+    # Load the tokenizer off the event loop; on failure analyses use a character cap
+    try:
+        await asyncio.to_thread(load_encoding)
+    except RuntimeError as e:
+        logger.warning(f"{str(e)} Falling back to character-based truncation.")
+
+@app.on_event("startup")
+async def startup_db_indexes():
+    try:
+        await db.analysis_history.create_index([("timestamp", -1)])
+    except Exception as e:
+        logger.warning(f"Failed to create analysis history index: {str(e)}")
+
+@app.on_event("startup")
+async def startup_history_writer():
+    global _history_queue, _history_writer_task
+    _history_queue = asyncio.Queue()
+    _history_writer_task = asyncio.create_task(history_writer())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    # Drain pending history writes before closing the client
+    if _history_writer_task is not None:
+        _history_queue.put_nowait(None)
+        await _history_writer_task
+    client.close()
+    if _http_session is not None:
+        await _http_session.close()
\ No newline at end of file